@@ -1,13 +1,103 @@
 #!/usr/bin/env python3
 import os
-import json
 import sys
+import atexit
+import logging
+import logging.handlers
+import math
+import queue
+import mmap
 import time
-from datetime import datetime
-from flask import Flask, render_template, request, jsonify
+import threading
+import uuid
+from concurrent import futures
+try:
+    import orjson
+except ImportError:
+    orjson = None
+from flask import Flask, render_template, request
 
 app = Flask(__name__)
 
+# Log records are queued by the caller and written out by a listener thread,
+# so logging never blocks a request or a step loop on stream I/O
+log_queue = queue.SimpleQueue()
+logger = logging.getLogger('motor')
+logger.addHandler(logging.handlers.QueueHandler(log_queue))
+logger.setLevel(logging.INFO)
+# Hosts such as Gunicorn configure the root logger, whose handlers would write
+# every record again synchronously
+logger.propagate = False
+log_listener = logging.handlers.QueueListener(log_queue, logging.StreamHandler())
+log_listener.start()
+atexit.register(log_listener.stop)
+
+# JSON encoding to bytes and decoding from a bytes-like object. orjson has no
+# PyPy build, so fall back to the json module, which PyPy's JIT runs fast enough
+if orjson is not None:
+    def _dumps(obj, indent=False):
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+    
+    _loads = orjson.loads
+else:
+    import json
+    
+    def _dumps(obj, indent=False):
+        if indent:
+            return json.dumps(obj, indent=2).encode()
+        return json.dumps(obj, separators=(',', ':')).encode()
+    
+    def _loads(data):
+        return json.loads(bytes(data))
+
+# Formatted timestamp of the current wall-clock second, as (second, text)
+_ts_cache = (0, '')
+
+# Return the current time as text, formatting it at most once per second
+def now_ts():
+    global _ts_cache
+    
+    second = int(time.time())
+    cached = _ts_cache
+    if cached[0] != second:
+        cached = (second, time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(second)))
+        _ts_cache = cached
+    return cached[1]
+
+# Templates for timestamped status responses, copied for each response
+_OK_TMPL = {'status': 'success', 'message': '', 'timestamp': ''}
+_ERR_TMPL = {'status': 'error', 'message': '', 'timestamp': ''}
+
+# Fill a copy of a response template with a message and the current time
+def from_template(template, message):
+    body = template.copy()
+    body['message'] = message
+    body['timestamp'] = now_ts()
+    return body
+
+# Build a JSON response, encoding the body to bytes up front
+def ojson(obj):
+    return app.response_class(_dumps(obj), mimetype='application/json')
+
+# Sleeps end this long before the deadline, the rest is spent busy-waiting
+BUFFER_NS = 60_000
+
+# Step loops that never sleep pause for YIELD_SECONDS every YIELD_STEPS steps.
+# A real-time thread only gives way to normal threads when it blocks, so
+# time.sleep(0) would not let the /stop_all request run on a single-core Pi
+YIELD_STEPS = 100
+YIELD_SECONDS = 0.0001
+
+# Sleep for delay seconds, spinning for the final stretch since time.sleep
+# overshoots short delays by tens of microseconds
+def psleep(delay):
+    target = time.perf_counter_ns() + int(delay * 1e9)
+    remaining = target - time.perf_counter_ns()
+    if remaining > BUFFER_NS:
+        time.sleep((remaining - BUFFER_NS) / 1e9)
+    while time.perf_counter_ns() < target:
+        pass
+
 # Configuration file path
 CONFIG_FILE = 'motor_config.json'
 
@@ -17,32 +107,145 @@ DEFAULT_CONFIG = {
     'motor2': {'step_pin': 22, 'dir_pin': 23}
 }
 
-print("Starting Raspberry Pi Motor Control System...")
-print(f"Python version: {sys.version}")
-print(f"Running as user ID: {os.geteuid()}")
+# Ways a motor's step pulses can be generated, set per motor as 'backend':
+# 'bitbang' drives the step pin from software (pigpio, lgpio or Python),
+# 'pwm' uses a hardware PWM channel and 'spi' clocks pulses out of SPI0 MOSI
+BACKENDS = ('bitbang', 'pwm', 'spi')
+
+# Hardware PWM channel of each PWM-capable BCM pin
+PWM_CHANNELS = {12: 0, 13: 1, 18: 0, 19: 1}
+
+# SPI device used by the 'spi' backend, and the BCM pin of its MOSI line
+SPI_BUS = 0
+SPI_DEVICE = 0
+SPI_MOSI_PIN = 10
+
+# Pin function that connects each PWM/SPI step pin to its peripheral
+PERIPHERAL_ALT = {12: 'ALT0', 13: 'ALT0', 18: 'ALT5', 19: 'ALT5', SPI_MOSI_PIN: 'ALT0'}
+
+# Bytes written per SPI transfer at most, spidev's default buffer size
+SPI_CHUNK = 4096
+
+# SPI clock range the 'spi' backend accepts. The slowest clock is the core
+# clock over the largest divider (500 MHz / 65536 on a Pi 4), slower requests
+# would be silently clamped by the driver and step faster than asked
+SPI_MIN_HZ = 7629
+SPI_MAX_HZ = 125_000_000
+
+# SPI writes are sized to last about this long, so a stop is noticed quickly
+SPI_WRITE_SECONDS = 0.01
+
+# Step delay used when neither the request nor the motor config sets one
+DEFAULT_DELAY = 0.001
+
+# Mapping of BCM pin numbers to physical header pin numbers
+BCM_TO_PHYSICAL = {
+    2: 3, 3: 5, 4: 7, 17: 11, 27: 13, 22: 15, 10: 19, 9: 21, 11: 23, 5: 29, 
+    6: 31, 13: 33, 19: 35, 26: 37, 14: 8, 15: 10, 18: 12, 23: 16, 24: 18, 
+    25: 22, 8: 24, 7: 26, 12: 32, 16: 36, 20: 38, 21: 40
+}
+
+# Raspberry Pi has BCM pins 0-27
+ALL_BCM = tuple(range(28))
+
+# Roles a BCM pin can have in PIN_ROLE
+PIN_FREE = 0
+PIN_STEP = 1
+PIN_DIR = 2
+ROLE_NAMES = {PIN_STEP: 'step', PIN_DIR: 'direction'}
+
+# Complete mapping of physical pin numbers to pin types and descriptions
+HEADER_PINS = (
+    {'physical_pin': 1, 'type': 'power', 'description': '3.3V Power'},
+    {'physical_pin': 2, 'type': 'power', 'description': '5V Power', 'in_use': True, 'used_by': 'Power'},
+    {'physical_pin': 3, 'type': 'gpio', 'bcm_pin': 2, 'description': 'GPIO 2 (SDA)'},
+    {'physical_pin': 4, 'type': 'power', 'description': '5V Power'},
+    {'physical_pin': 5, 'type': 'gpio', 'bcm_pin': 3, 'description': 'GPIO 3 (SCL)'},
+    {'physical_pin': 6, 'type': 'ground', 'description': 'Ground', 'in_use': True, 'used_by': 'Ground'},
+    {'physical_pin': 7, 'type': 'gpio', 'bcm_pin': 4, 'description': 'GPIO 4 (GPCLK0)'},
+    {'physical_pin': 8, 'type': 'gpio', 'bcm_pin': 14, 'description': 'GPIO 14 (TXD)'},
+    {'physical_pin': 9, 'type': 'ground', 'description': 'Ground'},
+    {'physical_pin': 10, 'type': 'gpio', 'bcm_pin': 15, 'description': 'GPIO 15 (RXD)'},
+    {'physical_pin': 11, 'type': 'gpio', 'bcm_pin': 17, 'description': 'GPIO 17'},
+    {'physical_pin': 12, 'type': 'gpio', 'bcm_pin': 18, 'description': 'GPIO 18 (PCM_CLK)'},
+    {'physical_pin': 13, 'type': 'gpio', 'bcm_pin': 27, 'description': 'GPIO 27'},
+    {'physical_pin': 14, 'type': 'ground', 'description': 'Ground'},
+    {'physical_pin': 15, 'type': 'gpio', 'bcm_pin': 22, 'description': 'GPIO 22'},
+    {'physical_pin': 16, 'type': 'gpio', 'bcm_pin': 23, 'description': 'GPIO 23'},
+    {'physical_pin': 17, 'type': 'power', 'description': '3.3V Power'},
+    {'physical_pin': 18, 'type': 'gpio', 'bcm_pin': 24, 'description': 'GPIO 24'},
+    {'physical_pin': 19, 'type': 'gpio', 'bcm_pin': 10, 'description': 'GPIO 10 (MOSI)'},
+    {'physical_pin': 20, 'type': 'ground', 'description': 'Ground'},
+    {'physical_pin': 21, 'type': 'gpio', 'bcm_pin': 9, 'description': 'GPIO 9 (MISO)'},
+    {'physical_pin': 22, 'type': 'gpio', 'bcm_pin': 25, 'description': 'GPIO 25'},
+    {'physical_pin': 23, 'type': 'gpio', 'bcm_pin': 11, 'description': 'GPIO 11 (SCLK)'},
+    {'physical_pin': 24, 'type': 'gpio', 'bcm_pin': 8, 'description': 'GPIO 8 (CE0)'},
+    {'physical_pin': 25, 'type': 'ground', 'description': 'Ground'},
+    {'physical_pin': 26, 'type': 'gpio', 'bcm_pin': 7, 'description': 'GPIO 7 (CE1)'},
+    {'physical_pin': 27, 'type': 'gpio', 'bcm_pin': 0, 'description': 'GPIO 0 (ID_SD)'},
+    {'physical_pin': 28, 'type': 'gpio', 'bcm_pin': 1, 'description': 'GPIO 1 (ID_SC)'},
+    {'physical_pin': 29, 'type': 'gpio', 'bcm_pin': 5, 'description': 'GPIO 5'},
+    {'physical_pin': 30, 'type': 'ground', 'description': 'Ground'},
+    {'physical_pin': 31, 'type': 'gpio', 'bcm_pin': 6, 'description': 'GPIO 6'},
+    {'physical_pin': 32, 'type': 'gpio', 'bcm_pin': 12, 'description': 'GPIO 12 (PWM0)'},
+    {'physical_pin': 33, 'type': 'gpio', 'bcm_pin': 13, 'description': 'GPIO 13 (PWM1)'},
+    {'physical_pin': 34, 'type': 'ground', 'description': 'Ground'},
+    {'physical_pin': 35, 'type': 'gpio', 'bcm_pin': 19, 'description': 'GPIO 19 (MISO)'},
+    {'physical_pin': 36, 'type': 'gpio', 'bcm_pin': 16, 'description': 'GPIO 16'},
+    {'physical_pin': 37, 'type': 'gpio', 'bcm_pin': 26, 'description': 'GPIO 26'},
+    {'physical_pin': 38, 'type': 'gpio', 'bcm_pin': 20, 'description': 'GPIO 20 (MOSI)'},
+    {'physical_pin': 39, 'type': 'ground', 'description': 'Ground'},
+    {'physical_pin': 40, 'type': 'gpio', 'bcm_pin': 21, 'description': 'GPIO 21 (SCLK)'}
+)
+
+logger.info("Starting Raspberry Pi Motor Control System...")
+logger.info("Python version: %s", sys.version)
+logger.info("Running as user ID: %s", os.geteuid())
+
+# Give the calling thread real-time priority where allowed, to reduce step
+# timing jitter. Only step workers call this, request threads keep normal
+# priority so /stop_all is always scheduled
+def enable_realtime():
+    try:
+        os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(20))
+        logger.info("Real-time scheduling enabled for step worker")
+    except (AttributeError, OSError) as e:
+        logger.warning("Real-time scheduling not available: %s", e)
 
 # Function to load pin configuration
 def load_config():
     try:
         if os.path.exists(CONFIG_FILE):
-            with open(CONFIG_FILE, 'r') as f:
-                return json.load(f)
+            # Parse straight from the mapped file instead of a decoded copy
+            with open(CONFIG_FILE, 'rb') as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    with memoryview(mm) as view:
+                        config = _loads(view)
+            # Pin numbers of a hand-edited config may be strings, e.g. "17"
+            for pins in config.values():
+                pins['step_pin'] = int(pins['step_pin'])
+                pins['dir_pin'] = int(pins['dir_pin'])
+            return config
         else:
             # If config file doesn't exist, create it with default values
             save_config(DEFAULT_CONFIG)
             return DEFAULT_CONFIG
     except Exception as e:
-        print(f"Error loading config: {e}")
+        logger.error("Error loading config: %s", e)
         return DEFAULT_CONFIG
 
 # Function to save pin configuration
 def save_config(config):
     try:
-        with open(CONFIG_FILE, 'w') as f:
-            json.dump(config, f, indent=4)
+        # Write to a temporary file and swap it in, so a crash mid-write
+        # cannot leave a truncated config behind
+        tmp_file = CONFIG_FILE + '.tmp'
+        with open(tmp_file, 'wb') as f:
+            f.write(_dumps(config, indent=True))
+        os.replace(tmp_file, CONFIG_FILE)
         return True
     except Exception as e:
-        print(f"Error saving config: {e}")
+        logger.error("Error saving config: %s", e)
         return False
 
 # Mock GPIO class for when real GPIO access fails
@@ -56,19 +259,90 @@ class MockGPIO:
     
     @staticmethod
     def setmode(mode):
-        print(f"Mock: GPIO.setmode({mode})")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Mock: GPIO.setmode(%s)", mode)
+        
+    @staticmethod
+    def setup(pin, mode):
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Mock: GPIO.setup(%s, %s)", pin, mode)
+        
+    @staticmethod
+    def output(pin, value):
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Mock: GPIO.output(%s, %s)", pin, value)
+        
+    @staticmethod
+    def cleanup():
+        logger.debug("Mock: GPIO.cleanup()")
+
+# GPIO class backed by the pigpio daemon, for when RPi.GPIO is not installed
+class PigpioGPIO:
+    OUT = 1
+    IN = 0
+    HIGH = 1
+    LOW = 0
+    BCM = 11
+    BOARD = 10
+    
+    # Pins set up as outputs, returned to inputs on cleanup
+    pins = set()
+    
+    @staticmethod
+    def setmode(mode):
+        # pigpio always uses BCM numbering
+        pass
         
     @staticmethod
     def setup(pin, mode):
-        print(f"Mock: GPIO.setup({pin}, {mode})")
+        pi.set_mode(pin, pigpio.OUTPUT if mode == PigpioGPIO.OUT else pigpio.INPUT)
+        PigpioGPIO.pins.add(pin)
         
     @staticmethod
     def output(pin, value):
-        print(f"Mock: GPIO.output({pin}, {value})")
+        pi.write(pin, value)
         
     @staticmethod
     def cleanup():
-        print("Mock: GPIO.cleanup()")
+        for pin in PigpioGPIO.pins:
+            pi.set_mode(pin, pigpio.INPUT)
+        PigpioGPIO.pins.clear()
+
+# GPIO class backed by an lgpio gpiochip handle, for when RPi.GPIO cannot
+# access the pins, e.g. on a Raspberry Pi 5
+class LgpioGPIO:
+    OUT = 1
+    IN = 0
+    HIGH = 1
+    LOW = 0
+    BCM = 11
+    BOARD = 10
+    
+    # Pins claimed through lgpio, released on cleanup
+    pins = set()
+    
+    @staticmethod
+    def setmode(mode):
+        # lgpio line offsets match BCM numbering
+        pass
+        
+    @staticmethod
+    def setup(pin, mode):
+        if mode == LgpioGPIO.OUT:
+            lgpio.gpio_claim_output(lgpio_handle, pin, 0)
+        else:
+            lgpio.gpio_claim_input(lgpio_handle, pin)
+        LgpioGPIO.pins.add(pin)
+        
+    @staticmethod
+    def output(pin, value):
+        lgpio.gpio_write(lgpio_handle, pin, value)
+        
+    @staticmethod
+    def cleanup():
+        for pin in LgpioGPIO.pins:
+            lgpio.gpio_free(lgpio_handle, pin)
+        LgpioGPIO.pins.clear()
 
 # Global variables
 GPIO = None
@@ -76,11 +350,88 @@ GPIO_AVAILABLE = False
 motor_config = load_config()
 active_pins = set()
 gpio_initialized = False
+# Step pins claimed on lgpio_handle for its pulse generator, kept apart from
+# GPIO so another library's claim on the line cannot get in the way
+lgpio_step_pins = set()
+# Set when motor_config changed since GPIO was last initialized
+_config_dirty = True
+# Pins set up as plain outputs since startup. GPIO cleanup leaves them as
+# inputs, which drops a PWM/SPI function the boot overlay had given them
+_gpio_driven_pins = set()
+# Role and owning motor of each BCM pin, indexed by BCM pin number
+PIN_ROLE = bytearray(len(ALL_BCM))
+PIN_MOTOR = [None] * len(ALL_BCM)
+# Pre-serialized /get_config and /available_pins responses, rebuilt on config change
+_cfg_cache = {'config': None, 'avail': None}
+# Runs step trains off the request threads, one worker per default motor
+executor = futures.ThreadPoolExecutor(max_workers=2, initializer=enable_realtime)
+# Step jobs by id, each with its motor, future and stop event
+jobs = {}
+jobs_lock = threading.Lock()
+# Serializes pigpio waveform transmission between motors
+wave_lock = threading.Lock()
+
+# Number of gpiochip devices searched for the GPIO header
+GPIOCHIP_PROBE_COUNT = 8
+
+# Try to connect to the pigpio daemon so step pulses can be timed by DMA
+pi = None
+try:
+    import pigpio
+    pi = pigpio.pi()
+    if pi.connected:
+        pi.wave_clear()
+        logger.info("pigpio daemon connected, step pulses will use DMA waveforms")
+    else:
+        logger.info("pigpio daemon not running")
+        pi = None
+except ImportError as e:
+    logger.info("Error importing pigpio: %s", e)
+    pi = None
+
+# Open the gpiochip that carries the 40-pin header. It is gpiochip0 on most
+# models, but gpiochip4 on a Raspberry Pi 5 with older kernels
+def open_gpiochip():
+    for chip in range(GPIOCHIP_PROBE_COUNT):
+        try:
+            handle = lgpio.gpiochip_open(chip)
+        except lgpio.error:
+            continue
+        label = lgpio.gpio_get_chip_info(handle)[3]
+        if label.startswith('pinctrl-'):
+            logger.info("Using gpiochip%s (%s) with lgpio", chip, label)
+            return handle
+        lgpio.gpiochip_close(handle)
+    raise RuntimeError('no gpiochip for the GPIO header found')
+
+# Without pigpio, fall back to lgpio's native pulse generator
+lgpio_handle = None
+if pi is None:
+    try:
+        import lgpio
+        lgpio_handle = open_gpiochip()
+        logger.info("lgpio gpiochip opened, step pulses will be generated natively")
+    except ImportError as e:
+        logger.info("Error importing lgpio: %s", e)
+    except Exception as e:
+        logger.warning("Error opening gpiochip with lgpio: %s", e)
+
+# Pick the GPIO class to use when RPi.GPIO cannot drive the pins, e.g. under
+# PyPy or on a Raspberry Pi 5
+def fallback_gpio():
+    if pi is not None:
+        logger.info("Using pigpio for GPIO access")
+        return PigpioGPIO, True
+    if lgpio_handle is not None:
+        logger.info("Using lgpio for GPIO access")
+        return LgpioGPIO, True
+    logger.warning("Using MockGPIO for testing")
+    return MockGPIO, False
 
 # Try to import GPIO, fall back to mock if not available
 try:
     import RPi.GPIO as GPIO
-    print("RPi.GPIO imported successfully")
+    logger.info("RPi.GPIO imported successfully")
     
     # Test GPIO access - this will fail if we don't have proper permissions
     try:
@@ -88,26 +439,102 @@ try:
         GPIO.setup(17, GPIO.OUT)  # Test with pin 17
         GPIO.cleanup()
         GPIO_AVAILABLE = True
-        print("GPIO access confirmed")
+        logger.info("GPIO access confirmed")
     except Exception as e:
-        print(f"GPIO access test failed: {e}")
-        print("Falling back to mock GPIO mode")
-        GPIO = MockGPIO
-        GPIO_AVAILABLE = False
+        logger.warning("GPIO access test failed: %s", e)
+        GPIO, GPIO_AVAILABLE = fallback_gpio()
 except (ImportError, RuntimeError) as e:
-    print(f"Error importing RPi.GPIO: {e}")
-    GPIO = MockGPIO
-    GPIO_AVAILABLE = False
-    print("Using MockGPIO for testing")
+    logger.warning("Error importing RPi.GPIO: %s", e)
+    GPIO, GPIO_AVAILABLE = fallback_gpio()
+
+# Finished jobs kept for /motor_status before the oldest are dropped
+MAX_JOBS = 100
+
+# Seconds /stop_all waits for step trains to exit before releasing the pins
+STOP_TIMEOUT = 1.0
+
+# pigpio wave chains repeat a waveform at most 65535 times per loop
+WAVE_CHAIN_MAX_REPEAT = 65535
+
+# Optional peripherals for the 'pwm' and 'spi' backends
+try:
+    from rpi_hardware_pwm import HardwarePWM
+except ImportError as e:
+    logger.info("Error importing rpi_hardware_pwm: %s", e)
+    HardwarePWM = None
+
+try:
+    import spidev
+except ImportError as e:
+    logger.info("Error importing spidev: %s", e)
+    spidev = None
+
+# Record the role and owning motor of every configured pin
+def index_pins():
+    PIN_ROLE[:] = bytes(len(PIN_ROLE))
+    PIN_MOTOR[:] = [None] * len(PIN_MOTOR)
+    for motor, pins in motor_config.items():
+        for pin, role in ((pins['step_pin'], PIN_STEP), (pins['dir_pin'], PIN_DIR)):
+            if 0 <= pin < len(PIN_ROLE):
+                PIN_ROLE[pin] = role
+                PIN_MOTOR[pin] = motor
+
+# Describe the motor function using a pin, e.g. "motor1 step"
+def pin_label(pin, default=None):
+    role = PIN_ROLE[pin]
+    if role == PIN_FREE:
+        return default
+    return f"{PIN_MOTOR[pin]} {ROLE_NAMES[role]}"
+
+# Serialize the responses that depend only on the pin configuration
+def rebuild_caches():
+    # Add physical pin numbers to the configuration
+    config_with_physical = {}
+    for motor, pins in motor_config.items():
+        config_with_physical[motor] = {
+            'step_pin': pins['step_pin'],
+            'dir_pin': pins['dir_pin'],
+            'step_pin_physical': BCM_TO_PHYSICAL.get(pins['step_pin'], 'Unknown'),
+            'dir_pin_physical': BCM_TO_PHYSICAL.get(pins['dir_pin'], 'Unknown'),
+            'backend': pins.get('backend', 'bitbang'),
+            'delay': pins.get('delay', DEFAULT_DELAY)
+        }
+    
+    # Mark GPIO pins that are in use by motors
+    all_pins = []
+    for pin in HEADER_PINS:
+        if pin['type'] == 'gpio' and not pin.get('in_use'):
+            used_by = pin_label(pin['bcm_pin'])
+            pin = dict(pin, in_use=used_by is not None, used_by=used_by)
+        all_pins.append(pin)
+    
+    _cfg_cache['config'] = _dumps({
+        'status': 'success',
+        'config': config_with_physical
+    })
+    _cfg_cache['avail'] = _dumps({
+        'status': 'success',
+        'available_pins': all_pins
+    })
+
+# Release the step pins claimed for lgpio's pulse generator
+def release_lgpio_step_pins():
+    for pin in lgpio_step_pins:
+        lgpio.gpio_free(lgpio_handle, pin)
+    lgpio_step_pins.clear()
 
 # Initialize GPIO
 def init_gpio():
-    global gpio_initialized, motor_config, active_pins, GPIO, GPIO_AVAILABLE
+    global gpio_initialized, motor_config, active_pins, GPIO, GPIO_AVAILABLE, _config_dirty
+    
+    index_pins()
+    rebuild_caches()
     
     try:
-        print(f"Initializing GPIO with config: {motor_config}")
+        logger.info("Initializing GPIO with config: %s", motor_config)
         # Clean up any existing GPIO configuration
         GPIO.cleanup()
+        release_lgpio_step_pins()
         active_pins = set()
         
         # Set GPIO mode
@@ -118,35 +545,251 @@ def init_gpio():
             step_pin = pins['step_pin']
             dir_pin = pins['dir_pin']
             
-            GPIO.setup(step_pin, GPIO.OUT)
+            # Step pins of PWM and SPI motors are driven by the peripheral
+            if pins.get('backend', 'bitbang') != 'bitbang':
+                if pi is not None:
+                    pi.set_mode(step_pin, getattr(pigpio, PERIPHERAL_ALT[step_pin]))
+            elif lgpio_handle is not None:
+                # lgpio's pulse generator drives the step pin on its own handle
+                lgpio.gpio_claim_output(lgpio_handle, step_pin, 0)
+                lgpio_step_pins.add(step_pin)
+                _gpio_driven_pins.add(step_pin)
+            else:
+                GPIO.setup(step_pin, GPIO.OUT)
+                GPIO.output(step_pin, GPIO.LOW)
+                _gpio_driven_pins.add(step_pin)
             GPIO.setup(dir_pin, GPIO.OUT)
-            GPIO.output(step_pin, GPIO.LOW)
             GPIO.output(dir_pin, GPIO.LOW)
+            _gpio_driven_pins.add(dir_pin)
             active_pins.add(step_pin)
             active_pins.add(dir_pin)
         
         gpio_initialized = True
-        print(f"GPIO initialized with configuration: {motor_config}")
-        print(f"Active pins: {active_pins}")
+        _config_dirty = False
+        logger.info("GPIO initialized with configuration: %s", motor_config)
+        logger.info("Active pins: %s", active_pins)
         return True
     except Exception as e:
-        print(f"Error initializing GPIO: {e}")
+        logger.error("Error initializing GPIO: %s", e)
+        not_alloc = "GPIO not allocated" in str(e)
         # If using mock or if it's a permission issue, pretend initialization succeeded
-        if not GPIO_AVAILABLE or "GPIO not allocated" in str(e):
-            if "GPIO not allocated" in str(e):
-                print("GPIO permission error detected, switching to mock mode")
+        if not GPIO_AVAILABLE or not_alloc:
+            if not_alloc:
+                logger.warning("GPIO permission error detected, switching to mock mode")
                 GPIO = MockGPIO
                 GPIO_AVAILABLE = False
             
             # In mock mode, we still want to pretend initialization succeeded
             gpio_initialized = True
-            print("Mock GPIO initialized successfully")
+            _config_dirty = False
+            logger.info("Mock GPIO initialized successfully")
             return True
         return False
 
+# Generate step pulses with a pigpio waveform instead of a Python loop
+def wave_step(step_pin, steps, delay, job):
+    stop_evt = job['stop']
+    pulse_us = max(1, int(delay * 1e6))
+    
+    # pigpio transmits one waveform at a time, so motors take turns and a job
+    # waiting for the transmitter is reported as queued
+    if not wave_lock.acquire(blocking=False):
+        job['state'] = 'queued'
+        while not wave_lock.acquire(timeout=0.01):
+            if stop_evt.is_set():
+                return
+        job['state'] = 'running'
+    try:
+        # Build a single step period and repeat it with a wave chain loop, so
+        # the waveform size does not grow with the number of steps
+        pi.wave_add_generic([
+            pigpio.pulse(1 << step_pin, 0, pulse_us),
+            pigpio.pulse(0, 1 << step_pin, pulse_us)
+        ])
+        wave_id = pi.wave_create()
+        try:
+            while steps > 0 and not stop_evt.is_set():
+                count = min(steps, WAVE_CHAIN_MAX_REPEAT)
+                pi.wave_chain([255, 0, wave_id, 255, 1, count & 0xFF, count >> 8])
+                while pi.wave_tx_busy():
+                    # /stop_all may have run its wave_tx_stop before this chain
+                    # started, so stop the transmission from here as well
+                    if stop_evt.is_set():
+                        pi.wave_tx_stop()
+                        break
+                    time.sleep(0.001)
+                steps -= count
+        finally:
+            pi.wave_delete(wave_id)
+    finally:
+        wave_lock.release()
+
+# Generate step pulses with lgpio's C pulse thread instead of a Python loop
+def lgpio_step(step_pin, steps, delay, stop_evt):
+    if steps == 0:
+        return
+    
+    # The step pin was claimed on lgpio_handle by init_gpio
+    pulse_us = max(1, int(delay * 1e6))
+    lgpio.tx_pulse(lgpio_handle, step_pin, pulse_us, pulse_us, 0, steps)
+    while lgpio.tx_busy(lgpio_handle, step_pin, lgpio.TX_PWM):
+        if stop_evt.is_set():
+            lgpio.tx_pulse(lgpio_handle, step_pin, 0, 0)
+            break
+        time.sleep(0.001)
+
+# Generate step pulses by toggling the pin from Python
+def python_step(step_pin, steps, delay, stop_evt):
+    # Bind globals and attributes to locals so the loop avoids repeated lookups
+    output = GPIO.output
+    high = GPIO.HIGH
+    low = GPIO.LOW
+    stopped = stop_evt.is_set
+    
+    sleep = time.sleep
+    
+    # Full speed stepping, e.g. for homing, skips waiting entirely
+    if delay == 0:
+        for i in range(steps):
+            if stopped():
+                break
+            output(step_pin, high)
+            output(step_pin, low)
+            if i % YIELD_STEPS == YIELD_STEPS - 1:
+                sleep(YIELD_SECONDS)
+        return
+    
+    # Delays too short to sleep for are spun out on the clock directly
+    delay_ns = int(delay * 1e9)
+    if delay_ns <= BUFFER_NS:
+        clock = time.perf_counter_ns
+        for i in range(steps):
+            if stopped():
+                break
+            output(step_pin, high)
+            deadline = clock() + delay_ns
+            while clock() < deadline:
+                pass
+            output(step_pin, low)
+            deadline = clock() + delay_ns
+            while clock() < deadline:
+                pass
+            if i % YIELD_STEPS == YIELD_STEPS - 1:
+                sleep(YIELD_SECONDS)
+        return
+    
+    precise_sleep = psleep
+    for _ in range(steps):
+        if stopped():
+            break
+        output(step_pin, high)
+        precise_sleep(delay)
+        output(step_pin, low)
+        precise_sleep(delay)
+
+# Generate step pulses with a hardware PWM channel at 50% duty cycle
+def pwm_step(step_pin, steps, delay, stop_evt):
+    if HardwarePWM is None:
+        raise RuntimeError('rpi_hardware_pwm is not installed')
+    if step_pin not in PWM_CHANNELS:
+        raise ValueError(f'GPIO {step_pin} has no hardware PWM channel')
+    if delay <= 0:
+        raise ValueError('PWM backend needs a positive delay')
+    
+    # The step count is reached by running the PWM for the matching duration
+    pwm = HardwarePWM(pwm_channel=PWM_CHANNELS[step_pin], hz=1 / (2 * delay))
+    pwm.start(50)
+    try:
+        stop_evt.wait(steps * 2 * delay)
+    finally:
+        pwm.stop()
+
+# Describe why the SPI clock cannot produce a step delay, or return None
+def spi_delay_error(delay):
+    if not 1 / SPI_MAX_HZ <= delay <= 1 / SPI_MIN_HZ:
+        return (f'SPI backend needs a delay between {1e6 / SPI_MAX_HZ:.3f} and '
+                f'{1e6 / SPI_MIN_HZ:.0f} microseconds')
+    return None
+
+# Generate step pulses by clocking a bit pattern out of the SPI MOSI line
+def spi_step(steps, delay, stop_evt):
+    if spidev is None:
+        raise RuntimeError('spidev is not installed')
+    delay_error = spi_delay_error(delay)
+    if delay_error:
+        raise ValueError(delay_error)
+    
+    # Every bit lasts delay seconds, so each 0xAA byte is four step pulses and
+    # a final partial byte holds the remaining one to three
+    full, partial = divmod(steps, 4)
+    data = b'\xaa' * full
+    if partial:
+        data += bytes([(0xAA00 >> (2 * partial)) & 0xFF])
+    
+    # Keep each write short so an emergency stop takes effect within it
+    hz = int(1 / delay)
+    chunk = min(SPI_CHUNK, max(1, int(hz * SPI_WRITE_SECONDS) // 8))
+    
+    spi = spidev.SpiDev()
+    spi.open(SPI_BUS, SPI_DEVICE)
+    try:
+        spi.mode = 0
+        spi.max_speed_hz = hz
+        for start in range(0, len(data), chunk):
+            if stop_evt.is_set():
+                break
+            spi.writebytes2(data[start:start + chunk])
+    finally:
+        spi.close()
+
+# Step a motor on an executor thread and return the job result
+def run_steps(motor, steps, delay, direction, job):
+    stop_evt = job['stop']
+    job['state'] = 'running'
+    try:
+        # Get pin configuration for the selected motor
+        pins = motor_config[motor]
+        step_pin = pins['step_pin']
+        dir_pin = pins['dir_pin']
+        
+        # Set direction
+        GPIO.output(dir_pin, GPIO.HIGH if direction else GPIO.LOW)
+        
+        # Step the motor
+        backend = pins.get('backend', 'bitbang')
+        if GPIO_AVAILABLE and backend == 'pwm':
+            pwm_step(step_pin, steps, delay, stop_evt)
+        elif GPIO_AVAILABLE and backend == 'spi':
+            spi_step(steps, delay, stop_evt)
+        elif GPIO_AVAILABLE and pi is not None:
+            wave_step(step_pin, steps, delay, job)
+        elif step_pin in lgpio_step_pins:
+            lgpio_step(step_pin, steps, delay, stop_evt)
+        else:
+            python_step(step_pin, steps, delay, stop_evt)
+        
+        if stop_evt.is_set():
+            return from_template(_ERR_TMPL, f'Movement of {motor} interrupted by emergency stop')
+        
+        return from_template(_OK_TMPL, f'Moved {motor} {steps} steps {"forward" if direction else "backward"}')
+    except Exception as e:
+        return from_template(_ERR_TMPL, f'Error moving motor: {e}')
+
+# Motors with a step train that has not finished, called with jobs_lock held
+def moving_motors():
+    return {job['motor'] for job in jobs.values() if not job['future'].done()}
+
+# Drop the oldest finished jobs once more than MAX_JOBS are tracked
+def prune_jobs():
+    for job_id in list(jobs):
+        if len(jobs) <= MAX_JOBS:
+            break
+        if jobs[job_id]['future'].done():
+            del jobs[job_id]
+
 # Initialize GPIO on startup
 init_result = init_gpio()
-print(f"GPIO initialization result: {init_result}")
+logger.info("GPIO initialization result: %s", init_result)
 
 @app.route('/')
 def index():
@@ -156,158 +799,130 @@ def index():
 def move_motor():
     global gpio_initialized, motor_config
     
-    if not gpio_initialized:
-        init_gpio()
-    
     motor = request.json.get('motor')
     steps = request.json.get('steps', 100)
-    delay = request.json.get('delay', 0.001)
     
     # Validate input
     if motor not in motor_config:
-        return jsonify({'status': 'error', 'message': f'Invalid motor: {motor}'})
+        return ojson({'status': 'error', 'message': f'Invalid motor: {motor}'})
     
+    delay = request.json.get('delay', motor_config[motor].get('delay', DEFAULT_DELAY))
     try:
         steps = int(steps)
         delay = float(delay)
-    except ValueError:
-        return jsonify({'status': 'error', 'message': 'Invalid steps or delay value'})
+    except (TypeError, ValueError):
+        return ojson({'status': 'error', 'message': 'Invalid steps or delay value'})
+    if not math.isfinite(delay):
+        return ojson({'status': 'error', 'message': 'Delay must be a finite number'})
+    if delay < 0:
+        return ojson({'status': 'error', 'message': 'Delay cannot be negative'})
+    if motor_config[motor].get('backend', 'bitbang') == 'spi':
+        delay_error = spi_delay_error(delay)
+        if delay_error:
+            return ojson({'status': 'error', 'message': delay_error})
     
     # Set direction based on steps value
     direction = steps > 0
     steps = abs(steps)
     
-    try:
-        # Get pin configuration for the selected motor
-        pins = motor_config[motor]
-        step_pin = pins['step_pin']
-        dir_pin = pins['dir_pin']
+    with jobs_lock:
+        # Only one step train may drive a motor at a time
+        moving = moving_motors()
+        if motor in moving:
+            return ojson(from_template(_ERR_TMPL, f'{motor} is already moving'))
         
-        # Set direction
-        GPIO.output(dir_pin, GPIO.HIGH if direction else GPIO.LOW)
+        # Reinitializing releases every pin, so it must wait for running moves
+        if _config_dirty or not gpio_initialized:
+            if moving:
+                return ojson(from_template(_ERR_TMPL, f'Cannot initialize GPIO while {", ".join(sorted(moving))} is moving'))
+            init_gpio()
         
-        # Step the motor
-        for _ in range(steps):
-            GPIO.output(step_pin, GPIO.HIGH)
-            time.sleep(delay)
-            GPIO.output(step_pin, GPIO.LOW)
-            time.sleep(delay)
+        # Step the motor in the background and let the client poll for the result
+        # pigpio moves wait while another motor's waveform is being transmitted
+        waits = GPIO_AVAILABLE and pi is not None and motor_config[motor].get('backend', 'bitbang') == 'bitbang'
+        action = 'Queued move of' if waits and wave_lock.locked() else 'Moving'
         
-        return jsonify({
-            'status': 'success',
-            'message': f'Moved {motor} {steps} steps {"forward" if direction else "backward"}',
-            'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        })
-    except Exception as e:
-        return jsonify({
-            'status': 'error',
-            'message': f'Error moving motor: {str(e)}',
-            'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        job_id = uuid.uuid4().hex
+        job = {'motor': motor, 'stop': threading.Event(), 'state': 'queued'}
+        job['future'] = executor.submit(run_steps, motor, steps, delay, direction, job)
+        jobs[job_id] = job
+        prune_jobs()
+    
+    body = from_template(_OK_TMPL, f'{action} {motor} {steps} steps {"forward" if direction else "backward"}')
+    body['job_id'] = job_id
+    return ojson(body), 202
+
+@app.route('/motor_status/<job_id>', methods=['GET'])
+def motor_status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return ojson({'status': 'error', 'message': f'Unknown job: {job_id}'})
+    
+    if not job['future'].done():
+        state = job['state']
+        return ojson({
+            'status': state,
+            'message': f'{job["motor"]} is {"moving" if state == "running" else "waiting for another motor"}',
+            'job_id': job_id
         })
+    
+    return ojson(dict(job['future'].result(), job_id=job_id))
 
 @app.route('/stop_all', methods=['POST'])
 def stop_all():
-    global gpio_initialized
+    global gpio_initialized, active_pins
     
     try:
+        # Interrupt every step train in progress
+        with jobs_lock:
+            running = [job for job in jobs.values() if not job['future'].done()]
+        for job in running:
+            job['stop'].set()
+        
+        # Abort any step waveform that is still being transmitted
+        if pi is not None:
+            pi.wave_tx_stop()
+        
+        # Let the step trains exit before the pins are released
+        futures.wait([job['future'] for job in running], timeout=STOP_TIMEOUT)
+        
         if gpio_initialized:
             GPIO.cleanup()
+            release_lgpio_step_pins()
             gpio_initialized = False
-            print("Emergency stop: All GPIO pins released")
+            active_pins = set()
+            logger.info("Emergency stop: All GPIO pins released")
         
-        return jsonify({
-            'status': 'success',
-            'message': 'Emergency stop activated. All motors stopped.',
-            'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        })
+        return ojson(from_template(_OK_TMPL, 'Emergency stop activated. All motors stopped.'))
     except Exception as e:
-        return jsonify({
-            'status': 'error',
-            'message': f'Error during emergency stop: {str(e)}',
-            'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        })
+        return ojson(from_template(_ERR_TMPL, f'Error during emergency stop: {e}'))
 
 @app.route('/get_config', methods=['GET'])
 def get_config():
-    global motor_config
-    
-    # Create a mapping of physical pin numbers to BCM pin numbers
-    bcm_to_physical = {
-        2: 3, 3: 5, 4: 7, 17: 11, 27: 13, 22: 15, 10: 19, 9: 21, 11: 23, 5: 29, 
-        6: 31, 13: 33, 19: 35, 26: 37, 14: 8, 15: 10, 18: 12, 23: 16, 24: 18, 
-        25: 22, 8: 24, 7: 26, 12: 32, 16: 36, 20: 38, 21: 40
-    }
-    
-    # Add physical pin numbers to the configuration
-    config_with_physical = {}
-    for motor, pins in motor_config.items():
-        config_with_physical[motor] = {
-            'step_pin': pins['step_pin'],
-            'dir_pin': pins['dir_pin'],
-            'step_pin_physical': bcm_to_physical.get(pins['step_pin'], 'Unknown'),
-            'dir_pin_physical': bcm_to_physical.get(pins['dir_pin'], 'Unknown')
-        }
-    
-    return jsonify({
-        'status': 'success',
-        'config': config_with_physical
-    })
+    return app.response_class(_cfg_cache['config'], mimetype='application/json')
 
 @app.route('/gpio_info', methods=['GET'])
 def gpio_info():
     global gpio_initialized, motor_config, active_pins
     
-    if not gpio_initialized:
-        init_gpio()
-    
-    # Create a mapping of physical pin numbers to BCM pin numbers
-    bcm_to_physical = {
-        2: 3, 3: 5, 4: 7, 17: 11, 27: 13, 22: 15, 10: 19, 9: 21, 11: 23, 5: 29, 
-        6: 31, 13: 33, 19: 35, 26: 37, 14: 8, 15: 10, 18: 12, 23: 16, 24: 18, 
-        25: 22, 8: 24, 7: 26, 12: 32, 16: 36, 20: 38, 21: 40
-    }
-    
-    # Create mapping of pins to motors
-    pin_to_motor = {}
-    for motor, pins in motor_config.items():
-        pin_to_motor[pins['step_pin']] = f"{motor} step"
-        pin_to_motor[pins['dir_pin']] = f"{motor} direction"
-    
     # Collect GPIO pin information
-    gpio_pins = []
-    for bcm_pin in range(28):  # Raspberry Pi has BCM pins 0-27
-        pin_info = {
-            'bcm_pin': bcm_pin,
-            'physical_pin': bcm_to_physical.get(bcm_pin, 'N/A'),
-            'active': bcm_pin in active_pins,
-            'function': pin_to_motor.get(bcm_pin, 'Unused'),
-            'is_motor_pin': bcm_pin in active_pins
-        }
-        gpio_pins.append(pin_info)
+    gpio_pins = [{
+        'bcm_pin': bcm_pin,
+        'physical_pin': BCM_TO_PHYSICAL.get(bcm_pin, 'N/A'),
+        'active': gpio_initialized and bool(PIN_ROLE[bcm_pin]),
+        'function': pin_label(bcm_pin, 'Unused'),
+        'is_motor_pin': bool(PIN_ROLE[bcm_pin])
+    } for bcm_pin in ALL_BCM]
     
     # Get all available BCM pins for dropdowns
-    available_pins = []
-    for pin in range(28):
-        # Skip pins that are currently in use by another motor
-        if pin in active_pins:
-            for motor, pins in motor_config.items():
-                if pin == pins['step_pin'] or pin == pins['dir_pin']:
-                    available_pins.append({
-                        'bcm_pin': pin, 
-                        'physical_pin': bcm_to_physical.get(pin, 'N/A'),
-                        'in_use': True,
-                        'used_by': pin_to_motor.get(pin, 'Unknown')
-                    })
-                    break
-        else:
-            available_pins.append({
-                'bcm_pin': pin, 
-                'physical_pin': bcm_to_physical.get(pin, 'N/A'),
-                'in_use': False,
-                'used_by': None
-            })
+    available_pins = [{
+        'bcm_pin': pin,
+        'physical_pin': BCM_TO_PHYSICAL.get(pin, 'N/A'),
+        'in_use': bool(PIN_ROLE[pin]),
+        'used_by': pin_label(pin)
+    } for pin in ALL_BCM]
     
-    return jsonify({
+    return ojson({
         'status': 'success',
         'gpio_initialized': gpio_initialized,
         'gpio_available': GPIO_AVAILABLE,
@@ -321,14 +936,14 @@ def gpio_info():
 
 @app.route('/update_pins', methods=['POST'])
 def update_pins():
-    global motor_config, gpio_initialized
+    global motor_config, gpio_initialized, _config_dirty
     
     try:
         # Get the new pin configuration from the request
         new_config = request.json
         
         if not new_config:
-            return jsonify({
+            return ojson({
                 'status': 'error',
                 'message': 'No configuration provided'
             })
@@ -337,7 +952,7 @@ def update_pins():
         required_keys = ['motor', 'step_pin', 'dir_pin']
         for key in required_keys:
             if key not in new_config:
-                return jsonify({
+                return ojson({
                     'status': 'error',
                     'message': f'Missing required field: {key}'
                 })
@@ -348,122 +963,128 @@ def update_pins():
         
         # Check if motor exists
         if motor not in motor_config:
-            return jsonify({
+            return ojson({
                 'status': 'error',
                 'message': f'Invalid motor: {motor}'
             })
         
+        # Step delay used for moves that do not set one
+        delay = float(new_config.get('delay', motor_config[motor].get('delay', DEFAULT_DELAY)))
+        if not math.isfinite(delay):
+            return ojson({
+                'status': 'error',
+                'message': 'Delay must be a finite number'
+            })
+        if delay < 0:
+            return ojson({
+                'status': 'error',
+                'message': 'Delay cannot be negative'
+            })
+        
+        # Check that both pins are BCM GPIO pins
+        if not (0 <= step_pin < len(PIN_ROLE) and 0 <= dir_pin < len(PIN_ROLE)):
+            return ojson({
+                'status': 'error',
+                'message': f'Pins must be BCM GPIO pins 0-{len(PIN_ROLE) - 1}'
+            })
+        
         # Check for pin conflicts with other motors
-        for other_motor, pins in motor_config.items():
-            if other_motor == motor:
-                continue
-            
-            if step_pin in [pins['step_pin'], pins['dir_pin']] or dir_pin in [pins['step_pin'], pins['dir_pin']]:
-                return jsonify({
+        for pin in (step_pin, dir_pin):
+            if PIN_ROLE[pin] and PIN_MOTOR[pin] != motor:
+                return ojson({
                     'status': 'error',
-                    'message': f'Pin conflict with {other_motor}. Choose different pins.'
+                    'message': f'Pin conflict with {PIN_MOTOR[pin]}. Choose different pins.'
                 })
         
+        # Check the step pulse backend and the step pin it requires
+        backend = new_config.get('backend', motor_config[motor].get('backend', 'bitbang'))
+        if backend not in BACKENDS:
+            return ojson({
+                'status': 'error',
+                'message': f'Invalid backend: {backend}'
+            })
+        if backend == 'pwm' and step_pin not in PWM_CHANNELS:
+            return ojson({
+                'status': 'error',
+                'message': 'PWM backend needs a hardware PWM step pin (GPIO 12, 13, 18 or 19)'
+            })
+        if backend == 'pwm':
+            for other, pins in motor_config.items():
+                if (other != motor and pins.get('backend', 'bitbang') == 'pwm'
+                        and PWM_CHANNELS.get(pins['step_pin']) == PWM_CHANNELS[step_pin]):
+                    return ojson({
+                        'status': 'error',
+                        'message': f'PWM channel {PWM_CHANNELS[step_pin]} is already used by {other}'
+                    })
+        if backend == 'spi' and step_pin != SPI_MOSI_PIN:
+            return ojson({
+                'status': 'error',
+                'message': f'SPI backend needs the SPI MOSI pin (GPIO {SPI_MOSI_PIN}) as step pin'
+            })
+        if (backend != 'bitbang' and pi is None and GPIO_AVAILABLE
+                and step_pin in _gpio_driven_pins):
+            return ojson({
+                'status': 'error',
+                'message': (f'GPIO {step_pin} was used as a plain output since startup and has '
+                            f'lost its {backend.upper()} function. Reboot the Raspberry Pi, or '
+                            f'restart the app with the pigpio daemon running so it can be restored')
+            })
+        if backend == 'spi' and spi_delay_error(delay):
+            return ojson({
+                'status': 'error',
+                'message': f'{spi_delay_error(delay)}, set a motor delay that fits'
+            })
+        
         # Check if step and dir pins are the same
         if step_pin == dir_pin:
-            return jsonify({
+            return ojson({
                 'status': 'error',
                 'message': 'Step and direction pins cannot be the same'
             })
         
-        # Update the configuration
-        motor_config[motor]['step_pin'] = step_pin
-        motor_config[motor]['dir_pin'] = dir_pin
-        
-        # Save the configuration
-        save_config(motor_config)
-        
-        # Reinitialize GPIO with the new configuration
-        gpio_initialized = False
-        init_result = init_gpio()
+        # Reinitializing releases every pin, so no motor may be moving, and
+        # jobs_lock keeps new moves from starting until it is done
+        with jobs_lock:
+            moving = moving_motors()
+            if moving:
+                return ojson({
+                    'status': 'error',
+                    'message': f'Cannot change pins while {", ".join(sorted(moving))} is moving'
+                })
+            
+            # Update the configuration
+            motor_config[motor]['step_pin'] = step_pin
+            motor_config[motor]['dir_pin'] = dir_pin
+            motor_config[motor]['backend'] = backend
+            if 'delay' in new_config:
+                motor_config[motor]['delay'] = delay
+            _config_dirty = True
+            
+            # Save the configuration
+            save_config(motor_config)
+            
+            # Reinitialize GPIO with the new configuration
+            gpio_initialized = False
+            init_result = init_gpio()
         
-        return jsonify({
+        return ojson({
             'status': 'success',
             'message': f'Pin configuration for {motor} updated successfully',
             'new_config': motor_config[motor],
             'gpio_initialized': gpio_initialized
         })
     except Exception as e:
-        return jsonify({
+        return ojson({
             'status': 'error',
-            'message': f'Error updating pin configuration: {str(e)}'
+            'message': f'Error updating pin configuration: {e}'
         })
 
 # Get list of available GPIO pins (useful for dropdown selection)
 @app.route('/available_pins', methods=['GET'])
 def available_pins():
-    global motor_config, active_pins
-    
-    # Complete mapping of physical pin numbers to pin types and descriptions
-    all_pins = [
-        {'physical_pin': 1, 'type': 'power', 'description': '3.3V Power'},
-        {'physical_pin': 2, 'type': 'power', 'description': '5V Power', 'in_use': True, 'used_by': 'Power'},
-        {'physical_pin': 3, 'type': 'gpio', 'bcm_pin': 2, 'description': 'GPIO 2 (SDA)'},
-        {'physical_pin': 4, 'type': 'power', 'description': '5V Power'},
-        {'physical_pin': 5, 'type': 'gpio', 'bcm_pin': 3, 'description': 'GPIO 3 (SCL)'},
-        {'physical_pin': 6, 'type': 'ground', 'description': 'Ground', 'in_use': True, 'used_by': 'Ground'},
-        {'physical_pin': 7, 'type': 'gpio', 'bcm_pin': 4, 'description': 'GPIO 4 (GPCLK0)'},
-        {'physical_pin': 8, 'type': 'gpio', 'bcm_pin': 14, 'description': 'GPIO 14 (TXD)'},
-        {'physical_pin': 9, 'type': 'ground', 'description': 'Ground'},
-        {'physical_pin': 10, 'type': 'gpio', 'bcm_pin': 15, 'description': 'GPIO 15 (RXD)'},
-        {'physical_pin': 11, 'type': 'gpio', 'bcm_pin': 17, 'description': 'GPIO 17'},
-        {'physical_pin': 12, 'type': 'gpio', 'bcm_pin': 18, 'description': 'GPIO 18 (PCM_CLK)'},
-        {'physical_pin': 13, 'type': 'gpio', 'bcm_pin': 27, 'description': 'GPIO 27'},
-        {'physical_pin': 14, 'type': 'ground', 'description': 'Ground'},
-        {'physical_pin': 15, 'type': 'gpio', 'bcm_pin': 22, 'description': 'GPIO 22'},
-        {'physical_pin': 16, 'type': 'gpio', 'bcm_pin': 23, 'description': 'GPIO 23'},
-        {'physical_pin': 17, 'type': 'power', 'description': '3.3V Power'},
-        {'physical_pin': 18, 'type': 'gpio', 'bcm_pin': 24, 'description': 'GPIO 24'},
-        {'physical_pin': 19, 'type': 'gpio', 'bcm_pin': 10, 'description': 'GPIO 10 (MOSI)'},
-        {'physical_pin': 20, 'type': 'ground', 'description': 'Ground'},
-        {'physical_pin': 21, 'type': 'gpio', 'bcm_pin': 9, 'description': 'GPIO 9 (MISO)'},
-        {'physical_pin': 22, 'type': 'gpio', 'bcm_pin': 25, 'description': 'GPIO 25'},
-        {'physical_pin': 23, 'type': 'gpio', 'bcm_pin': 11, 'description': 'GPIO 11 (SCLK)'},
-        {'physical_pin': 24, 'type': 'gpio', 'bcm_pin': 8, 'description': 'GPIO 8 (CE0)'},
-        {'physical_pin': 25, 'type': 'ground', 'description': 'Ground'},
-        {'physical_pin': 26, 'type': 'gpio', 'bcm_pin': 7, 'description': 'GPIO 7 (CE1)'},
-        {'physical_pin': 27, 'type': 'gpio', 'bcm_pin': 0, 'description': 'GPIO 0 (ID_SD)'},
-        {'physical_pin': 28, 'type': 'gpio', 'bcm_pin': 1, 'description': 'GPIO 1 (ID_SC)'},
-        {'physical_pin': 29, 'type': 'gpio', 'bcm_pin': 5, 'description': 'GPIO 5'},
-        {'physical_pin': 30, 'type': 'ground', 'description': 'Ground'},
-        {'physical_pin': 31, 'type': 'gpio', 'bcm_pin': 6, 'description': 'GPIO 6'},
-        {'physical_pin': 32, 'type': 'gpio', 'bcm_pin': 12, 'description': 'GPIO 12 (PWM0)'},
-        {'physical_pin': 33, 'type': 'gpio', 'bcm_pin': 13, 'description': 'GPIO 13 (PWM1)'},
-        {'physical_pin': 34, 'type': 'ground', 'description': 'Ground'},
-        {'physical_pin': 35, 'type': 'gpio', 'bcm_pin': 19, 'description': 'GPIO 19 (MISO)'},
-        {'physical_pin': 36, 'type': 'gpio', 'bcm_pin': 16, 'description': 'GPIO 16'},
-        {'physical_pin': 37, 'type': 'gpio', 'bcm_pin': 26, 'description': 'GPIO 26'},
-        {'physical_pin': 38, 'type': 'gpio', 'bcm_pin': 20, 'description': 'GPIO 20 (MOSI)'},
-        {'physical_pin': 39, 'type': 'ground', 'description': 'Ground'},
-        {'physical_pin': 40, 'type': 'gpio', 'bcm_pin': 21, 'description': 'GPIO 21 (SCLK)'}
-    ]
-    
-    # Mark pins that are in use by motors
-    for pin in all_pins:
-        if pin.get('type') == 'gpio' and not pin.get('in_use'):
-            pin['in_use'] = False
-            pin['used_by'] = None
-            
-            # Check if pin is used by any motor
-            for motor, pins in motor_config.items():
-                if pin.get('bcm_pin') == pins['step_pin']:
-                    pin['in_use'] = True
-                    pin['used_by'] = f"{motor} step"
-                    break
-                elif pin.get('bcm_pin') == pins['dir_pin']:
-                    pin['in_use'] = True
-                    pin['used_by'] = f"{motor} direction"
-                    break
-    
-    return jsonify({
-        'status': 'success',
-        'available_pins': all_pins
-    })
+    return app.response_class(_cfg_cache['avail'], mimetype='application/json')
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', debug=True) 
\ No newline at end of file
+    # Development server only, deploy with: gunicorn -c gunicorn_conf.py app:app
+    # Debug mode stays off, its reloader would initialize GPIO in two processes
+    app.run(host='0.0.0.0', debug=False, threaded=True) 
\ No newline at end of file
@@ -0,0 +1,13 @@
+# Gunicorn configuration for the motor control server:
+#   gunicorn -c gunicorn_conf.py app:app
+
+# GPIO state and motor jobs live in the process, so run exactly one worker
+# and serve concurrent requests from its threads
+workers = 1
+threads = 4
+worker_class = 'gthread'
+
+bind = '0.0.0.0:5000'
+
+# Never kill the worker for a slow request
+timeout = 0